@@ -0,0 +1,185 @@
+"""
+This module contains the helpers shared by the export views and the background
+export task for writing table entries to Excel and CSV files.
+"""
+
+import csv
+import datetime
+import os
+import time
+import xlsxwriter
+
+from django.conf import settings
+from django.utils import timezone
+from app.models import MyTable
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Number of seconds a workbook built in the background stays available for download.
+EXPORT_FILE_MAX_AGE = 3600
+# Suffix of the marker file left behind when building a workbook in the background fails.
+EXPORT_FAILED_SUFFIX = '.failed'
+
+# Header labels and `values_list` fields of the exported columns. These never change, so they
+# are built once per process instead of on every export.
+_EXPORT_COLUMNS_USER = ('Client Name', 'Entry Date', 'Modified At', 'Contact Number',
+                        'Vendor Name', 'Vendor Company', 'Rate', 'Currency', 'Contract Type',
+                        'Status', 'Comments')
+_EXPORT_FIELDS_USER = ('client_name', 'date', 'modified_at', 'contact_number', 'vendor_name',
+                       'vendor_company', 'rate', 'currency', 'contract_type', 'status',
+                       'comments')
+# Superusers export the entries of every user, so they also get the owner of each entry.
+_EXPORT_COLUMNS_SU = _EXPORT_COLUMNS_USER + ('User',)
+_EXPORT_FIELDS_SU = _EXPORT_FIELDS_USER + ('user__username',)
+
+# In `constant_memory` mode every row is flushed to disk as soon as a later row is
+# started, so memory use stays flat no matter how many rows are exported. Excel has no
+# time zones, so dates are converted to local time and then written without one.
+_WORKBOOK_OPTIONS = {'constant_memory': True,
+                     'remove_timezone': True,
+                     'default_date_format': 'd/m/yyyy, hh:mm AM/PM'}
+# xlsxwriter formats belong to a single workbook, so only their properties can be shared.
+_HEADER_STYLE = {'bold': True}
+# The xlsxwriter method used to write the cells of each column. Calling the typed method
+# directly skips the type checks `write` otherwise repeats for every single cell.
+_COLUMN_WRITERS = {'Entry Date': 'write_datetime',
+                   'Modified At': 'write_datetime',
+                   'Rate': 'write_number'}
+# A worksheet holds at most 1,048,576 rows. One of them is the header, and longer exports
+# continue on further sheets instead of losing the remaining rows.
+_SHEET_ROW_LIMIT = 1048575
+
+
+def export_rows(user):
+    """
+    The function selects the entries and columns a user is allowed to export.
+    Superusers export the entries of every user, everyone else only their own.
+
+    :param user: The user the export is made for
+    :return: a tuple of the header labels, the `MyTable` queryset of the exported
+    entries and the `values_list` queryset holding the exported rows.
+    """
+    if user.is_superuser:
+        columns, fields = _EXPORT_COLUMNS_SU, _EXPORT_FIELDS_SU
+        records = MyTable.objects.all()
+    else:
+        columns, fields = _EXPORT_COLUMNS_USER, _EXPORT_FIELDS_USER
+        records = MyTable.objects.filter(user=user)
+    return columns, records, records.values_list(*fields)
+
+
+def local_datetime_writer(write_datetime):
+    """
+    The function wraps a worksheet's `write_datetime`, so dates are written in the
+    local time zone the details page shows them in instead of in UTC.
+
+    :param write_datetime: The `write_datetime` method of a worksheet
+    :return: a function taking the same arguments as `write_datetime`.
+    """
+    def write(row, col, value):
+        return write_datetime(row, col, timezone.localtime(value))
+    return write
+
+
+def write_workbook(output, columns, rows):
+    """
+    The function writes the header and every row of an export to an Excel workbook.
+    Rows that do not fit on the first sheet are continued on the sheets
+    'Data_2', 'Data_3' and so on, each starting with the header again.
+
+    :param output: The file name or file-like object the workbook is written to
+    :param columns: The header labels written as the first row
+    :param rows: The `values_list` queryset holding the rows to export
+    """
+    wbook = xlsxwriter.Workbook(output, _WORKBOOK_OPTIONS)
+    header_format = wbook.add_format(_HEADER_STYLE)
+    writer_names = [_COLUMN_WRITERS.get(column, 'write_string') for column in columns]
+
+    def add_sheet(name):
+        # The cell writers are bound once per sheet rather than looked up again for every cell.
+        wsheet = wbook.add_worksheet(name)
+        wsheet.write_row(0, 0, columns, header_format)
+        return [local_datetime_writer(wsheet.write_datetime) if writer_name == 'write_datetime'
+                else getattr(wsheet, writer_name) for writer_name in writer_names]
+
+    writers = add_sheet('Data')
+    rownum = 0
+    for row in rows.iterator(chunk_size=2000):
+        if rownum == _SHEET_ROW_LIMIT:
+            writers = add_sheet(f'Data_{len(wbook.worksheets()) + 1}')
+            rownum = 0
+        rownum += 1
+        for col_num, (write, value) in enumerate(zip(writers, row)):
+            write(rownum, col_num, value)
+
+    wbook.close()
+
+
+class Echo:  # pylint: disable=too-few-public-methods
+    """
+    The `Echo` class is a pseudo-buffer that hands back whatever is written to it
+    instead of storing it, so `csv.writer` can be used to build lines for streaming.
+    """
+
+    def write(self, value):
+        """
+        The function returns the value written to the buffer unchanged.
+        """
+        return value
+
+
+def stream_csv(columns, rows):
+    """
+    The function is a generator that yields the header and every row
+    of an export as CSV encoded lines. The entry date and modified at
+    columns are written in local time in ISO 8601 format.
+
+    :param columns: The header labels written as the first line
+    :param rows: The `values_list` queryset holding the rows to export
+    """
+    writerow = csv.writer(Echo()).writerow
+    yield writerow(columns)
+    for client_name, date, modified_at, *rest in rows.iterator(chunk_size=2000):
+        yield writerow((client_name, timezone.localtime(date).isoformat(),
+                        timezone.localtime(modified_at).isoformat(), *rest))
+
+
+def export_filename(extension):
+    """
+    The function returns the download name of an export, stamped with the current UTC time.
+    The stamp has no spaces or colons, so browsers keep the name as it is.
+
+    :param extension: The file extension of the export, without the leading dot
+    :return: a file name such as 'Data_20230701T093000Z.xlsx'.
+    """
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    return f'Data_{stamp}.{extension}'
+
+
+def export_path(file_name):
+    """
+    The function returns the location of a workbook built in the background.
+
+    :param file_name: The name of the workbook file
+    :return: the path of the file inside the `exports` folder of `MEDIA_ROOT`.
+    """
+    return os.path.join(settings.MEDIA_ROOT, 'exports', file_name)
+
+
+def remove_stale_exports():
+    """
+    The function deletes the workbooks built in the background whose
+    download links have already expired.
+    """
+    folder = export_path('')
+    if not os.path.isdir(folder):
+        return
+    expired = time.time() - EXPORT_FILE_MAX_AGE
+    for entry in os.scandir(folder):
+        # Several workers may clean up at the same time, so a file can disappear
+        # between finding it and removing it.
+        try:
+            if entry.is_file() and entry.stat().st_mtime < expired:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            continue
@@ -3,6 +3,7 @@ This module is used to apply filters on the models.
 """
 
 import django_filters
+from django.contrib.auth.models import User
 from app.models import MyTable
 
 
@@ -12,6 +13,10 @@ class FormFilter(django_filters.FilterSet):
     filters instances of the `MyTable` model based
     on the `status`, `currency`, and `user` fields.
     """
+    # The user dropdown only shows usernames, so the choices are loaded without the
+    # remaining columns of the user table.
+    user = django_filters.ModelChoiceFilter(queryset=User.objects.only('id', 'username'))
+
     class Meta:
         """
         The code snippet defines a class named "Meta".
@@ -14,7 +14,8 @@ class LoginForm(forms.Form):
     """
     username = forms.CharField(max_length=100, widget=forms.TextInput(
         attrs={'class': 'form-control', 'placeholder': 'Username'}))
-    password = forms.CharField(widget=forms.PasswordInput)
+    # Passwords may start or end with spaces, so they are passed on exactly as typed.
+    password = forms.CharField(widget=forms.PasswordInput, strip=False)
 
 
 class SignUpForm(UserCreationForm):
@@ -51,5 +51,15 @@ class MyTable(models.Model):
     status = models.CharField(max_length=20, choices=status_choices)
     comments = models.CharField(max_length=100)
 
+    class Meta:
+        """
+        The `indexes` back the per-user listing and export, which filter on `user` and
+        show the newest entries first, and the status filter on the details page.
+        """
+        indexes = [
+            models.Index(fields=['user', '-date']),
+            models.Index(fields=['status']),
+        ]
+
     def __str__(self):
         return str(self.vendor_name)
@@ -0,0 +1,46 @@
+"""
+This module contains the background tasks of the app, which are run by Celery workers.
+"""
+
+import logging
+import os
+
+from celery import shared_task
+from django.contrib.auth.models import User
+from app.exports import (EXPORT_FAILED_SUFFIX, export_path, export_rows, remove_stale_exports,
+                         write_workbook)
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def build_export(user_id, file_name):
+    """
+    The task builds the Excel export of a user into a file, so large exports
+    do not keep a web worker busy while every row is written. If building the
+    workbook fails, a marker file is left in its place instead.
+
+    :param user_id: The id of the user the export is made for
+    :param file_name: The name of the workbook file to create
+    """
+    path = export_path(file_name)
+    # The workbook is written under a temporary name and renamed once complete, so the
+    # download view never serves a half written file.
+    partial_path = path + '.part'
+    try:
+        remove_stale_exports()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        user = User.objects.get(pk=user_id)
+        columns, _, rows = export_rows(user)
+        write_workbook(partial_path, columns, rows)
+        os.replace(partial_path, path)
+    except Exception:
+        # The marker tells the download view to stop waiting for a workbook that will
+        # never be written.
+        logger.exception("Building the export %s failed.", file_name)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + EXPORT_FAILED_SUFFIX, 'w', encoding='utf-8'):
+            pass
+        raise
@@ -3,11 +3,40 @@
  This class is used for writing test cases in Django.
 """
 
+import datetime
+import io
+import re
+import tempfile
+import zipfile
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
 from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
 from .models import MyTable
 
 
+def create_entry(user, client_name='Test Client'):
+    """
+    The create_entry function creates a table entry owned by the
+    given user, filled in with the test values shared by the test cases.
+    """
+    return MyTable.objects.create(
+        user=user,
+        contact_number='+1234567890',
+        client_name=client_name,
+        vendor_name='Test Vendor',
+        vendor_company='Test Company',
+        rate=100.0,
+        currency='USD',
+        contract_type='Remote',
+        status='On Board',
+        comments='Test comments'
+    )
+
+
 class MyTableModelTestCase(TestCase):
     """
     The MyTableModelTestCase class is a test case for testing
@@ -21,18 +50,7 @@ class MyTableModelTestCase(TestCase):
         """
         self.user = User.objects.create_user(
             username='testuser', password='testpass')
-        self.mytable = MyTable.objects.create(
-            user=self.user,
-            contact_number='+1234567890',
-            client_name='Test Client',
-            vendor_name='Test Vendor',
-            vendor_company='Test Company',
-            rate=100.0,
-            currency='USD',
-            contract_type='Remote',
-            status='On Board',
-            comments='Test comments'
-        )
+        self.mytable = create_entry(self.user)
 
     def test_mytable_fields(self):
         """
@@ -53,3 +71,349 @@ class MyTableModelTestCase(TestCase):
         the vendor_name attribute.
         """
         self.assertEqual(str(self.mytable), self.mytable.vendor_name)
+
+
+class SignInViewTestCase(TestCase):
+    """
+    The SignInViewTestCase class is a test case for testing
+    the sign in of users.
+    """
+
+    def setUp(self):
+        """
+        The setUp function creates a test user whose password
+        ends with a space.
+        """
+        User.objects.create_user(username='testuser', password='testpass ')
+
+    def test_signin_with_valid_credentials(self):
+        """
+        The function tests that valid credentials log the user in
+        and redirect to the details page.
+        """
+        response = self.client.post(
+            reverse('signin'), {'username': ' testuser ', 'password': 'testpass '})
+        self.assertRedirects(response, reverse('details'))
+
+    def test_signin_redirects_logged_in_user(self):
+        """
+        The function tests that a logged in user is sent to the
+        details page instead of the sign in page.
+        """
+        self.client.login(username='testuser', password='testpass ')
+        self.assertRedirects(self.client.get(reverse('signin')), reverse('details'))
+
+    def test_signin_with_invalid_credentials(self):
+        """
+        The function tests that invalid credentials show the sign in
+        page again with an error message.
+        """
+        response = self.client.post(
+            reverse('signin'), {'username': 'testuser', 'password': 'testpass'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Username or Password is Incorrect')
+
+
+class DetailsViewTestCase(TestCase):
+    """
+    The DetailsViewTestCase class is a test case for testing
+    the listing of table entries on the details page.
+    """
+
+    def setUp(self):
+        """
+        The setUp function creates a superuser and a regular user,
+        each owning a single table entry.
+        """
+        self.admin = User.objects.create_superuser(
+            username='admin', password='adminpass')
+        self.user = User.objects.create_user(
+            username='testuser', password='testpass')
+        create_entry(self.admin, 'Admin Client')
+        create_entry(self.user)
+
+    def test_details_lists_only_own_entries(self):
+        """
+        The function tests that a regular user only sees their own
+        entries and the filter form is rendered.
+        """
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.get(reverse('details'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Test Client')
+        self.assertNotContains(response, 'Admin Client')
+        self.assertContains(response, 'name="status"')
+
+    def test_details_filters_entries(self):
+        """
+        The function tests that the filter parameters narrow down
+        the listed entries.
+        """
+        self.client.login(username='admin', password='adminpass')
+        response = self.client.get(reverse('details'), {'user': self.user.id})
+        self.assertContains(response, 'Test Client')
+        self.assertNotContains(response, 'Admin Client')
+
+    def test_details_shows_owner_to_superuser(self):
+        """
+        The function tests that a superuser sees the entries of every
+        user along with the username of their owner.
+        """
+        self.client.login(username='admin', password='adminpass')
+        response = self.client.get(reverse('details'))
+        self.assertContains(response, 'Admin Client')
+        self.assertContains(response, '<td>testuser</td>')
+
+    def test_details_rejects_post(self):
+        """
+        The function tests that the details page only answers GET requests.
+        """
+        self.client.login(username='testuser', password='testpass')
+        self.assertEqual(self.client.post(reverse('details')).status_code, 405)
+
+    def test_records_of_other_users_are_not_editable(self):
+        """
+        The function tests that a regular user can neither edit nor
+        delete an entry owned by another user.
+        """
+        entry = MyTable.objects.get(user=self.admin)
+        self.client.login(username='testuser', password='testpass')
+        self.assertEqual(
+            self.client.get(reverse('edit', args=[entry.id])).status_code, 404)
+        self.assertEqual(
+            self.client.post(reverse('delete', args=[entry.id])).status_code, 404)
+        self.assertTrue(MyTable.objects.filter(pk=entry.id).exists())
+
+    def test_delete_requires_post(self):
+        """
+        The function tests that an entry is only deleted by a POST request.
+        """
+        entry = MyTable.objects.get(user=self.user)
+        self.client.login(username='testuser', password='testpass')
+        self.assertEqual(
+            self.client.get(reverse('delete', args=[entry.id])).status_code, 405)
+        self.assertTrue(MyTable.objects.filter(pk=entry.id).exists())
+        self.assertRedirects(
+            self.client.post(reverse('delete', args=[entry.id])), reverse('details'))
+        self.assertFalse(MyTable.objects.filter(pk=entry.id).exists())
+
+
+class ExportExcelTestCase(TestCase):
+    """
+    The ExportExcelTestCase class is a test case for testing
+    the export of table entries to an Excel workbook.
+    """
+
+    def setUp(self):
+        """
+        The setUp function creates a test user with a single table
+        entry and logs the user in.
+        """
+        self.user = User.objects.create_user(
+            username='testuser', password='testpass')
+        create_entry(self.user)
+        self.client.login(username='testuser', password='testpass')
+        cache.clear()
+
+    def test_export_returns_xlsx_workbook(self):
+        """
+        The function tests that the export view returns an xlsx
+        workbook containing the user's entries.
+        """
+        response = self.client.get(reverse('export'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Content-Type'],
+            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        self.assertRegex(response['Content-Disposition'],
+                         r'^attachment; filename=Data_\d{8}T\d{6}Z\.xlsx$')
+        with zipfile.ZipFile(io.BytesIO(response.content)) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertIn('Client Name', sheet)
+        self.assertIn('Test Client', sheet)
+        # the rate is written as a number, not as text
+        self.assertIn('<c r="G2"><v>100.00</v></c>', sheet)
+
+    def test_export_requires_login(self):
+        """
+        The function tests that anonymous visitors are sent to the
+        sign in page instead of getting an export.
+        """
+        self.client.logout()
+        response = self.client.get(reverse('export'), {'format': 'csv'})
+        self.assertRedirects(response, reverse('signin') + '?next=/export/%3Fformat%3Dcsv',
+                             fetch_redirect_response=False)
+
+    def test_export_writes_local_times(self):
+        """
+        The function tests that the entry date is written in the local
+        time zone rather than in UTC.
+        """
+        response = self.client.get(reverse('export'))
+        with zipfile.ZipFile(io.BytesIO(response.content)) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        cell = float(re.search(r'<c r="B2" s="\d+"><v>([^<]+)</v>', sheet).group(1))
+        entry_date = timezone.localtime(MyTable.objects.get(user=self.user).date)
+        # Excel stores dates as the number of days since 30/12/1899
+        expected = (entry_date.replace(tzinfo=None)
+                    - datetime.datetime(1899, 12, 30)) / datetime.timedelta(days=1)
+        self.assertAlmostEqual(cell, expected, places=6)
+
+    def test_export_streams_large_workbook(self):
+        """
+        The function tests that a workbook above the cache size limit
+        is moved to a temporary file and streamed to the client instead
+        of being cached.
+        """
+        entry = MyTable.objects.get(user=self.user)
+        for number in range(50):
+            entry.pk = None
+            entry.client_name = f'Client {number}'
+            entry.save()
+        # Even the smallest workbook is several kilobytes, so it grows past this limit and
+        # the spooled file rolls over to disk.
+        with mock.patch('app.views._EXPORT_CACHE_MAX_SIZE', 1000):
+            response = self.client.get(reverse('export'))
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as workbook:
+            self.assertIn('Test Client', workbook.read('xl/worksheets/sheet1.xml').decode())
+        self.assertFalse(self.client.get(reverse('export')).streaming)
+
+    def test_export_continues_on_further_sheets(self):
+        """
+        The function tests that rows beyond the sheet size limit are
+        written to additional sheets which repeat the header.
+        """
+        entry = MyTable.objects.get(user=self.user)
+        entry.pk = None
+        entry.client_name = 'Second Client'
+        entry.save()
+        with mock.patch('app.exports._SHEET_ROW_LIMIT', 1):
+            response = self.client.get(reverse('export'))
+        with zipfile.ZipFile(io.BytesIO(response.content)) as workbook:
+            first = workbook.read('xl/worksheets/sheet1.xml').decode()
+            second = workbook.read('xl/worksheets/sheet2.xml').decode()
+            self.assertIn('Data_2', workbook.read('xl/workbook.xml').decode())
+        self.assertIn('Test Client', first)
+        self.assertNotIn('Second Client', first)
+        self.assertIn('Client Name', second)
+        self.assertIn('Second Client', second)
+
+    def test_export_streams_csv(self):
+        """
+        The function tests that requesting the CSV format streams
+        the header and the user's entries as CSV lines.
+        """
+        response = self.client.get(reverse('export'), {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('Client Name,Entry Date'))
+        entry = MyTable.objects.get(user=self.user)
+        local_date = timezone.localtime(entry.date).isoformat()
+        self.assertTrue(lines[1].startswith(f'Test Client,{local_date},'))
+
+    def test_export_reuses_cached_workbook(self):
+        """
+        The function tests that an unchanged export is served from the
+        cache, answers conditional requests and is rebuilt after an edit.
+        """
+        first = self.client.get(reverse('export'))
+        with self.assertNumQueries(3):
+            second = self.client.get(reverse('export'))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertFalse(first.has_header('Last-Modified'))
+
+        not_modified = self.client.get(reverse('export'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        entry = MyTable.objects.get(user=self.user)
+        entry.client_name = 'Renamed Client'
+        entry.save()
+        changed = self.client.get(reverse('export'))
+        self.assertNotEqual(first['ETag'], changed['ETag'])
+        with zipfile.ZipFile(io.BytesIO(changed.content)) as workbook:
+            self.assertIn('Renamed Client', workbook.read('xl/worksheets/sheet1.xml').decode())
+
+        entry.delete()
+        self.assertEqual(self.client.get(
+            reverse('export'), HTTP_IF_NONE_MATCH=changed['ETag']).status_code, 200)
+
+
+class ExportBackgroundTestCase(TestCase):
+    """
+    The ExportBackgroundTestCase class is a test case for testing
+    the Excel export built by the background task. Every test writes
+    the generated files to its own temporary `MEDIA_ROOT`.
+    """
+
+    def setUp(self):
+        """
+        The setUp function logs in a superuser owning a single table entry.
+        """
+        self.admin = User.objects.create_superuser(
+            username='admin', password='adminpass')
+        create_entry(self.admin, 'Admin Client')
+        self.client.login(username='admin', password='adminpass')
+
+    def test_background_export_is_downloadable(self):
+        """
+        The function tests that starting a background export hands out
+        a download link which serves the finished workbook.
+        """
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            response = self.client.post(reverse('export_background'))
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(self.client.get(reverse('export_background')).status_code, 405)
+            download = self.client.get(
+                reverse('export_download', args=[response.context['token']]))
+            self.assertEqual(download.status_code, 200)
+            self.assertTrue(download['Content-Disposition'].startswith('attachment'))
+            content = b''.join(download.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as workbook:
+            self.assertIn('Admin Client', workbook.read('xl/worksheets/sheet1.xml').decode())
+
+    def test_download_link_is_bound_to_user(self):
+        """
+        The function tests that a download link can not be used by
+        another user or after it has been tampered with.
+        """
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            token = self.client.post(reverse('export_background')).context['token']
+            self.assertEqual(
+                self.client.get(reverse('export_download', args=[token + 'x'])).status_code, 404)
+            User.objects.create_user(username='testuser', password='testpass')
+            self.client.login(username='testuser', password='testpass')
+            self.assertEqual(
+                self.client.get(reverse('export_download', args=[token])).status_code, 404)
+
+    def test_failed_background_export_stops_waiting(self):
+        """
+        The function tests that the download link reports an error
+        instead of waiting forever when building the workbook fails.
+        """
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            with mock.patch('app.tasks.write_workbook', side_effect=RuntimeError('broken')), \
+                    self.assertLogs('app.tasks', level='ERROR'):
+                token = self.client.post(reverse('export_background')).context['token']
+            response = self.client.get(reverse('export_download', args=[token]))
+        self.assertEqual(response.status_code, 500)
+        self.assertContains(response, 'could not be prepared', status_code=500)
+        self.assertNotContains(response, 'http-equiv="refresh"', status_code=500)
+
+    def test_failed_cleanup_stops_waiting(self):
+        """
+        The function tests that the download link also reports an error
+        when removing the expired exports fails before the workbook is built.
+        """
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            with mock.patch('app.tasks.remove_stale_exports', side_effect=OSError('broken')), \
+                    self.assertLogs('app.tasks', level='ERROR'):
+                token = self.client.post(reverse('export_background')).context['token']
+            response = self.client.get(reverse('export_download', args=[token]))
+        self.assertEqual(response.status_code, 500)
+        self.assertContains(response, 'could not be prepared', status_code=500)
@@ -14,4 +14,6 @@ urlpatterns = [
     path('signin/', views.signin, name='signin'),
     path('signout/', views.signout, name='signout'),
     path('export/', views.export_excel, name='export'),
+    path('export/background/', views.export_background, name='export_background'),
+    path('export/<str:token>/', views.export_download, name='export_download'),
 ]
@@ -4,17 +4,39 @@
 
 """
 
-import datetime
-import xlwt
+import hashlib
+import os
+import tempfile
+import time
+import uuid
 
 from django.contrib import messages
+from django.core import signing
+from django.core.cache import cache
 from django.shortcuts import render, redirect
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
-from django.http import HttpResponse, HttpResponseForbidden, HttpResponseServerError
+from django.db import DatabaseError
+from django.db.models import Count, Max
+from django.http import (FileResponse, Http404, HttpResponse, HttpResponseServerError,
+                         StreamingHttpResponse)
+from app.exports import (EXPORT_FAILED_SUFFIX, EXPORT_FILE_MAX_AGE, XLSX_CONTENT_TYPE,
+                         export_filename, export_path, export_rows, stream_csv, write_workbook)
 from app.forms import MyTableForm, SignUpForm, LoginForm
 from app.models import MyTable
 from app.filters import FormFilter
+from app.tasks import build_export
+
+# Number of seconds a generated workbook is kept, so repeated downloads of the same
+# export are served without querying and writing every row again.
+_EXPORT_CACHE_TIMEOUT = 300
+# Workbooks up to this many bytes are cached and sent in one piece, larger ones are
+# streamed from a temporary file in blocks of `_EXPORT_BLOCK_SIZE` bytes.
+_EXPORT_CACHE_MAX_SIZE = 1024 * 1024
+_EXPORT_BLOCK_SIZE = 64 * 1024
 
 
 def signup(request):
@@ -74,8 +96,8 @@ def signin(request):
     if request.method == 'POST':
         form = LoginForm(request.POST)
         if form.is_valid():
-            username = request.POST.get('username')
-            password = request.POST.get('password')
+            username = form.cleaned_data['username']
+            password = form.cleaned_data['password']
             user = authenticate(
                 request, username=username, password=password)
             if user is not None:
@@ -102,6 +124,7 @@ def signout(request):
 
 
 @login_required(login_url='signin')
+@require_GET
 def details(request):
     """
     This function retrieves details from a database table
@@ -115,33 +138,39 @@ def details(request):
     :return: a rendered HTML template called 'details.html' with the context variables 'details' and
     'filter'.
     """
-    try:
-        # The line `if request.user.is_superuser:` is checking if the user making the request is a
-        # superuser. A superuser is a special type of user in Django that has all permissions and
-        # privileges. If the user is a superuser, it means they have administrative access and can
-        # perform actions that regular users cannot. In this case, if the user is a superuser, all
-        # details from the `MyTable` model are retrieved and assigned to the `details` variable.
-        if request.user.is_superuser:
-            all_details = MyTable.objects.all()
-        else:
-            # The line `details = MyTable.objects.filter(user=request.user)` is filtering the
-            # `MyTable` objects based on the `user` field. It retrieves all the objects from the
-            # `MyTable` model where the `user` field matches the currently logged-in user
-            # (`request.user`). This ensures that only the details
-            # belonging to the logged-in user are
-            # retrieved and displayed.
-            all_details = MyTable.objects.filter(user=request.user)
-        # The line `filter = FormFilter(request.GET, queryset=details)`
-        # is creating an instance of the `FormFilter` class and
-        # initializing it with the `request.GET` data and the `details` queryset.
-        filtered = FormFilter(request.GET, queryset=all_details)
-        filtered_details = filtered.qs
-        return render(request, 'details.html', {'details': details, 'filter': filtered_details})
-    except Exception as error:
-        return HttpResponseServerError(f"An error occurred: {str(error)}")
+    # `select_related('user')` fetches the owner of every row in the same query, so
+    # showing the user column does not cost one extra query per row, and `only()`
+    # limits the joined user row to the username that the template displays.
+    table = MyTable.objects.select_related('user').only(
+        'id', 'client_name', 'date', 'modified_at', 'contact_number', 'vendor_name',
+        'vendor_company', 'rate', 'currency', 'contract_type', 'status', 'comments',
+        'user__username')
+    # The line `if request.user.is_superuser:` is checking if the user making the request is a
+    # superuser. A superuser is a special type of user in Django that has all permissions and
+    # privileges. If the user is a superuser, it means they have administrative access and can
+    # perform actions that regular users cannot. In this case, if the user is a superuser, all
+    # details from the `MyTable` model are retrieved and assigned to the `details` variable.
+    if request.user.is_superuser:
+        all_details = table.all()
+    else:
+        # The line `details = MyTable.objects.filter(user=request.user)` is filtering the
+        # `MyTable` objects based on the `user` field. It retrieves all the objects from the
+        # `MyTable` model where the `user` field matches the currently logged-in user
+        # (`request.user`). This ensures that only the details
+        # belonging to the logged-in user are
+        # retrieved and displayed.
+        all_details = table.filter(user=request.user)
+    # The line `filtered = FormFilter(request.GET, queryset=all_details)`
+    # is creating an instance of the `FormFilter` class and
+    # initializing it with the `request.GET` data and the `all_details` queryset.
+    # The filtered queryset is rendered as the table rows and the filter itself
+    # is passed along so the template can render its form.
+    filtered = FormFilter(request.GET, queryset=all_details)
+    return render(request, 'details.html', {'details': filtered.qs, 'filter': filtered})
 
 
 @login_required(login_url='signin')
+@require_http_methods(["GET", "POST"])
 def addnew(request):
     """
     The `addnew` function is a view function in Django that handles
@@ -159,19 +188,20 @@ def addnew(request):
     """
     form = MyTableForm()
     if request.method == 'POST':
-        try:
-            form = MyTableForm(request.POST)
-            if form.is_valid():
-                new_entry = form.save(commit=False)
-                new_entry.user = request.user
+        form = MyTableForm(request.POST)
+        if form.is_valid():
+            new_entry = form.save(commit=False)
+            new_entry.user = request.user
+            try:
                 new_entry.save()
-                return redirect('details')
-        except Exception as error:
-            return HttpResponseServerError(f"An error occurred: {str(error)}")
+            except DatabaseError as error:
+                return HttpResponseServerError(f"An error occurred: {str(error)}")
+            return redirect('details')
     return render(request, 'form.html', {'form': form})
 
 
 @login_required(login_url='signin')
+@require_http_methods(["GET", "POST"])
 def edit(request, req_id):
     """
     The `edit` function handles the editing of a record in
@@ -187,36 +217,42 @@ def edit(request, req_id):
     the record that needs to be edited. It is
     used to retrieve the specific record from the `MyTable` model
     :return: The code is returning different HTTP responses
-    based on certain conditions.
+    based on certain conditions. If the record does not exist or
+    belongs to another user, an `Http404` is raised.
     """
-    try:
-        edit_detail = MyTable.objects.get(id=req_id)
-        if not (edit_detail.user == request.user or request.user.is_superuser):
-            return HttpResponseForbidden("You don't have permission to edit this record.")
-
-        contract_type = edit_detail.contract_type
-        if request.method == 'POST':
-            form = MyTableForm(request.POST, instance=edit_detail)
-            if form.is_valid():
+    # Regular users may only edit their own records, so the ownership check is part of
+    # the lookup itself and records owned by someone else are never loaded.
+    records = MyTable.objects.filter(pk=req_id)
+    if not request.user.is_superuser:
+        records = records.filter(user_id=request.user.id)
+    edit_detail = records.first()
+    if edit_detail is None:
+        raise Http404("Record not found.")
+
+    contract_type = edit_detail.contract_type
+    if request.method == 'POST':
+        form = MyTableForm(request.POST, instance=edit_detail)
+        if form.is_valid():
+            try:
                 form.save()
-                return redirect('details')
-        else:
-            form = MyTableForm(instance=edit_detail)
-        return render(request, 'edit.html', {'edit_detail': edit_detail,
-                                             'contract_type': contract_type,
-                                             'form': form})
-    except MyTable.DoesNotExist:
-        return HttpResponseServerError("Record not found.")
-    except Exception as error:
-        return HttpResponseServerError(f"An error occurred: {str(error)}")
+            except DatabaseError as error:
+                return HttpResponseServerError(f"An error occurred: {str(error)}")
+            return redirect('details')
+    else:
+        form = MyTableForm(instance=edit_detail)
+    return render(request, 'edit.html', {'edit_detail': edit_detail,
+                                         'contract_type': contract_type,
+                                         'form': form})
 
 
 @login_required(login_url='signin')
+@require_POST
 def delete(request, req_id):
     """
     The function deletes a record from a table if the user
     has the necessary permissions, otherwise it
-    returns an appropriate error message.
+    returns an appropriate error message. Only POST requests
+    are accepted, so a link alone can never delete a record.
 
     :param request: The `request` parameter is an object
     that represents the HTTP request made by the
@@ -228,103 +264,145 @@ def delete(request, req_id):
     the `MyTable` model
     :return: an HTTP response. If the user has permission
     to delete the record, it will redirect them to
-    the 'details' page. If the record does not exist,
-    it will return an HTTP response indicating that
-    the record was not found. If any other exception occurs,
-    it will return an HTTP response indicating
-    that an error occurred, along with the error message.
+    the 'details' page. If the record does not exist or
+    belongs to another user, an `Http404` is raised.
     """
-    try:
-        detail = MyTable.objects.get(id=req_id)
-        if not (detail.user == request.user or request.user.is_superuser):
-            return HttpResponseForbidden("You don't have permission to delete this record.")
+    # Regular users may only delete their own records, so the ownership check is part of
+    # the lookup itself and records owned by someone else are never loaded.
+    records = MyTable.objects.filter(pk=req_id)
+    if not request.user.is_superuser:
+        records = records.filter(user_id=request.user.id)
+    detail = records.first()
+    if detail is None:
+        raise Http404("Record not found.")
 
-        detail.delete()
-        return redirect('details')
-    except MyTable.DoesNotExist:
-        return HttpResponseServerError("Record not found.")
-    except Exception as error:
-        return HttpResponseServerError(f"An error occurred: {str(error)}")
+    detail.delete()
+    return redirect('details')
 
 
+@login_required(login_url='signin')
 def export_excel(request):
     """
     The function exports data from a database table to an Excel file
     and allows for different columns to be included based on the user's permissions.
+    Passing `?format=csv` streams the same data as a CSV file instead.
+    Generated workbooks are cached for a few minutes and served with an `ETag`
+    header, so repeated downloads of unchanged data are cheap.
 
     :param request: The `request` parameter is an object that
     represents the HTTP request made by the client. It contains information about
     the request, such as the user making the request, the
     requested URL, and any data sent with the request
-    :return: an HttpResponse object.
+    :return: an HttpResponse object, or a StreamingHttpResponse for CSV exports.
     """
-    response = HttpResponse(content_type='application/ms-excel')
-    response['Content-Disposition'] = 'attachment; filename=Data_' + \
-        str(datetime.datetime.now()) + '.xls'
-
-    wbook = xlwt.Workbook(encoding='utf-8')
-    wsheet = wbook.add_sheet('Data')
-    rownum = 0
-    font_style = xlwt.XFStyle()
-    font_style.font.bold = True
-
+    columns, records, rows = export_rows(request.user)
+
+    # CSV exports are streamed line by line, so the first bytes reach the client
+    # straight away and nothing is buffered on the server.
+    if request.GET.get('format') == 'csv':
+        response = StreamingHttpResponse(stream_csv(columns, rows), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename={export_filename("csv")}'
+        return response
+
+    # Editing or adding an entry moves the latest modification time and deleting one lowers
+    # the row count, so together with the user and the query parameters they identify the
+    # workbook contents. Only an `ETag` is sent: a deletion does not move the latest
+    # modification time, so a `Last-Modified` date could report a changed export as unchanged.
+    stamp = records.aggregate(last_modified=Max('modified_at'), total=Count('id'))
+    fingerprint = [request.user.id, request.user.is_superuser, sorted(request.GET.lists()),
+                   stamp['last_modified'], stamp['total']]
     if request.user.is_superuser:
-        columns = ['Client Name', 'Entry Date', 'Modified At',
-                   'Contact Number', 'Vendor Name', 'Vendor Company',
-                   'Rate', 'Currency', 'Contract Type', 'Status',
-                   'Comments', 'User']
-
-        for col_num in range(len(columns)):
-            wsheet.write(rownum, col_num, columns[col_num], font_style)
-
-        font_style = xlwt.XFStyle()
-
-        rows = MyTable.objects.select_related('user').values_list('client_name',
-                                                                  'date',
-                                                                  'modified_at',
-                                                                  'contact_number',
-                                                                  'vendor_name',
-                                                                  'vendor_company',
-                                                                  'rate',
-                                                                  'currency',
-                                                                  'contract_type',
-                                                                  'status',
-                                                                  'comments',
-                                                                  'user__username')
-
-        for row in rows:
-            rownum += 1
-
-            for col_num in range(len(row)):
-                wsheet.write(rownum, col_num, str(row[col_num]), font_style)
-
+        # Renaming a user changes the exported 'User' column without touching any entry, so
+        # superuser exports are also tied to the cache period to show the new name in time.
+        fingerprint.append(int(time.time() // _EXPORT_CACHE_TIMEOUT))
+    etag = hashlib.sha1(repr(fingerprint).encode()).hexdigest()
+
+    response = get_conditional_response(request, etag=quote_etag(etag))
+    if response is not None:
+        return response
+
+    cache_key = 'export:' + etag
+    content = cache.get(cache_key)
+    if content is not None:
+        response = HttpResponse(content, content_type=XLSX_CONTENT_TYPE)
     else:
-        columns = ['Client Name', 'Entry Date', 'Modified At', 'Contact Number', 'Vendor Name',
-                   'Vendor Company', 'Rate', 'Currency', 'Contract Type', 'Status', 'Comments']
+        # The workbook is kept in memory while it is small and moved to a temporary file
+        # once it grows, so large exports never sit in memory as a whole.
+        # FileResponse closes the file once a large workbook has been sent.
+        output = tempfile.SpooledTemporaryFile(  # pylint: disable=consider-using-with
+            max_size=_EXPORT_CACHE_MAX_SIZE)
+        try:
+            write_workbook(output, columns, rows)
+        except BaseException:
+            output.close()
+            raise
+        size = output.seek(0, os.SEEK_END)
+        output.seek(0)
+        if size <= _EXPORT_CACHE_MAX_SIZE:
+            content = output.read()
+            output.close()
+            cache.set(cache_key, content, _EXPORT_CACHE_TIMEOUT)
+            response = HttpResponse(content, content_type=XLSX_CONTENT_TYPE)
+        else:
+            # Large workbooks are sent straight from the temporary file in blocks, so the
+            # client starts receiving data at once and the whole file is never buffered.
+            response = FileResponse(output, content_type=XLSX_CONTENT_TYPE)
+            response.block_size = _EXPORT_BLOCK_SIZE
+    response['Content-Disposition'] = f'attachment; filename={export_filename("xlsx")}'
+    response['ETag'] = quote_etag(etag)
 
-        for col_num in range(len(columns)):
-            wsheet.write(rownum, col_num, columns[col_num], font_style)
+    return response
 
-        font_style = xlwt.XFStyle()
 
-        rows = MyTable.objects.filter(user=request.user).values_list('client_name',
-                                                                     'date',
-                                                                     'modified_at',
-                                                                     'contact_number',
-                                                                     'vendor_name',
-                                                                     'vendor_company',
-                                                                     'rate',
-                                                                     'currency',
-                                                                     'contract_type',
-                                                                     'status',
-                                                                     'comments')
+@login_required(login_url='signin')
+@require_POST
+def export_background(request):
+    """
+    The function starts building the Excel export of the user in a background
+    worker and returns a page that waits for the workbook to be ready.
+    Only POST requests are accepted, so prefetched links never start an export.
 
-        for row in rows:
-            rownum += 1
+    :param request: The `request` parameter is an object that
+    represents the HTTP request made by the client. It contains information about
+    the request, such as the user making the request, the
+    requested URL, and any data sent with the request
+    :return: a rendered HTML template called 'export.html' with the signed
+    download token, sent with a 202 Accepted status.
+    """
+    file_name = f'{uuid.uuid4().hex}.xlsx'
+    build_export.delay(request.user.id, file_name)
+    # The token is signed, so it can only be used by the user who started the export
+    # and nobody can point it at another file.
+    token = signing.dumps({'user': request.user.id, 'file': file_name}, salt='export')
+    return render(request, 'export.html', {'token': token}, status=202)
 
-            for col_num in range(len(row)):
-                wsheet.write(rownum, col_num, str(row[col_num]), font_style)
 
-    wbook.save(response)
+@login_required(login_url='signin')
+def export_download(request, token):
+    """
+    The function serves a workbook built by `export_background`, or the waiting
+    page again while the background worker is still building it.
 
-    return response
+    :param request: The `request` parameter is an object that
+    represents the HTTP request made by the client. It contains information about
+    the request, such as the user making the request, the
+    requested URL, and any data sent with the request
+    :param token: The signed download token handed out by `export_background`
+    :return: a FileResponse with the workbook, or a rendered HTML template called
+    'export.html' with a 202 Accepted status while the workbook is not ready, or
+    with a 500 status if building it failed.
+    """
+    try:
+        export = signing.loads(token, salt='export', max_age=EXPORT_FILE_MAX_AGE)
+    except signing.BadSignature as error:
+        raise Http404("Export not found.") from error
+    if export['user'] != request.user.id:
+        raise Http404("Export not found.")
+
+    path = export_path(export['file'])
+    if os.path.exists(path + EXPORT_FAILED_SUFFIX):
+        return render(request, 'export.html', {'token': token, 'failed': True}, status=500)
+    if not os.path.exists(path):
+        return render(request, 'export.html', {'token': token}, status=202)
+    return FileResponse(open(path, 'rb'), as_attachment=True, content_type=XLSX_CONTENT_TYPE,
+                        filename=export_filename('xlsx'))
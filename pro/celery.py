@@ -0,0 +1,16 @@
+"""
+Celery configuration for pro project.
+
+Celery reads its settings from the `CELERY_` prefixed Django settings and picks up
+the `tasks` module of every installed app.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pro.settings')
+
+app = Celery('pro')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
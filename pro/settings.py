@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -128,6 +129,21 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Files generated by the app, such as the Excel exports built in the background.
+MEDIA_ROOT = BASE_DIR / 'media'
+
+
+# Celery
+# https://docs.celeryq.dev/en/stable/django/first-steps-with-django.html
+
+# `CELERY_BROKER_URL` points the background tasks at a message broker, for example
+# 'redis://localhost:6379/0'. Without a broker the tasks are run right away in the
+# web process, so the app keeps working when no worker is set up.
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', '')
+CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
+# The export download checks for the generated file itself, so task results are not stored.
+CELERY_TASK_IGNORE_RESULT = True
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 